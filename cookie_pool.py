@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import random
+import secrets
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class CookiePool:
+    """Uploaded cookie files, each with its own health record.
+
+    Jobs are spread across cookies weighted by their success rate, so no single session takes all
+    the traffic. A cookie that keeps failing is quarantined for a while and skipped by select();
+    a successful use (or live probe) brings it back.
+
+    Health counters live in memory and are written to disk by a debounced timer (and flush() at
+    shutdown), so recording a download result never touches the filesystem. Success rate and
+    status come from a sliding window of each cookie's most recent results.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.health_file = os.path.join(folder, 'pool_health.json')
+        self.metadata_file = os.path.join(folder, 'pool_metadata.json')
+        self.max_cookies = int(os.environ.get('COOKIE_POOL_MAX', 10))
+        self.quarantine_seconds = int(os.environ.get('COOKIE_QUARANTINE_MINUTES', 60)) * 60
+        self.window_size = int(os.environ.get('COOKIE_HEALTH_WINDOW', 20))  # Recent results behind success rate
+        self.flush_interval = int(os.environ.get('COOKIE_HEALTH_FLUSH_INTERVAL', 30))
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()  # Serializes writers of the health file
+        self.members: Dict[str, str] = {}  # cookie_id -> cookie file path
+        self.health: Dict[str, Dict] = {}
+        self.windows: Dict[str, deque] = {}  # cookie_id -> recent results (True = success)
+        self.metadata: Dict[str, Dict] = {}
+        self.dirty = False
+        self.flush_timer: Optional[threading.Timer] = None
+
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        try:
+            for name in os.listdir(self.folder):
+                if name.endswith('.txt'):
+                    self.members[name[:-4]] = os.path.join(self.folder, name)
+        except Exception as e:
+            logger.warning(f"Could not list cookie pool: {e}")
+
+        for attr, path in (('health', self.health_file), ('metadata', self.metadata_file)):
+            try:
+                if os.path.exists(path):
+                    with open(path, 'r') as f:
+                        setattr(self, attr, json.load(f))
+            except Exception as e:
+                logger.warning(f"Could not load {path}: {e}")
+
+        for cookie_id, health in self.health.items():
+            self.windows[cookie_id] = deque((bool(r) for r in health.pop('recent_results', [])), maxlen=self.window_size)
+
+        if self.members:
+            logger.info(f"Loaded cookie pool with {len(self.members)} cookie file(s)")
+
+    def _write_json(self, path: str, data: Dict):
+        try:
+            temp_file = path + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(temp_file, path)
+        except Exception as e:
+            logger.error(f"Error saving {path}: {e}")
+
+    def _health_snapshot_unlocked(self) -> Dict:
+        return {cookie_id: dict(health, recent_results=[int(r) for r in self.windows.get(cookie_id, ())])
+                for cookie_id, health in self.health.items()}
+
+    def _mark_dirty(self):
+        self.dirty = True
+        if self.flush_timer is None:
+            self.flush_timer = threading.Timer(self.flush_interval, self._timer_flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def _timer_flush(self):
+        with self.lock:
+            self.flush_timer = None
+        self.flush()
+
+    def flush(self):
+        """Persist health counters if anything changed since the last write.
+
+        Membership changes call this right away; routine results go through _mark_dirty().
+        """
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                self.dirty = False
+                snapshot = self._health_snapshot_unlocked()
+            self._write_json(self.health_file, snapshot)
+
+    def _save_metadata(self):
+        self._write_json(self.metadata_file, self.metadata)
+
+    @staticmethod
+    def _new_health() -> Dict:
+        return {
+            'total_uses': 0,
+            'successful_uses': 0,
+            'failed_uses': 0,
+            'last_success': None,
+            'last_failure': None,
+            'consecutive_failures': 0,
+            'recent_errors': [],
+            'quarantined_until': None
+        }
+
+    def _window(self, cookie_id: str) -> deque:
+        window = self.windows.get(cookie_id)
+        if window is None:
+            window = self.windows[cookie_id] = deque(maxlen=self.window_size)
+        return window
+
+    def _view(self, cookie_id: str, health: Dict) -> Dict:
+        """Health plus success rate and status, both derived from the recent-results window"""
+        window = self.windows.get(cookie_id) or ()
+        success_rate = sum(window) / len(window) * 100 if window else 0
+        consecutive_failures = health.get('consecutive_failures', 0)
+
+        # Evaluate status from worst to best (dead > failing > degraded > healthy)
+        status = 'healthy'
+        if consecutive_failures >= 5:
+            status = 'dead'
+        elif consecutive_failures >= 3:
+            status = 'failing'
+        elif success_rate < 50 and len(window) >= 5:
+            status = 'degraded'
+        return dict(health, success_rate=round(success_rate, 1), window_uses=len(window), status=status)
+
+    def add(self, content: str, filename: str) -> Tuple[str, str]:
+        """Store a new cookie file; returns (cookie_id, path)"""
+        with self.lock:
+            if len(self.members) >= self.max_cookies:
+                raise ValueError(f"Cookie pool is full ({self.max_cookies} files). Delete one first.")
+            cookie_id = secrets.token_hex(4)
+            path = os.path.join(self.folder, f'{cookie_id}.txt')
+            with open(path, 'w') as f:
+                f.write(content)
+            self.members[cookie_id] = path
+            self.metadata[cookie_id] = {
+                'upload_time': datetime.now().isoformat(),
+                'filename': filename,
+                'file_size': len(content)
+            }
+            self.health[cookie_id] = self._new_health()
+            self.windows[cookie_id] = deque(maxlen=self.window_size)
+            self._save_metadata()
+            self.dirty = True
+        self.flush()
+        return cookie_id, path
+
+    def adopt(self, path: str, metadata: Optional[Dict] = None, health: Optional[Dict] = None) -> Optional[str]:
+        """Move an existing cookie file (e.g. the old single COOKIES_FILE) into the pool"""
+        with self.lock:
+            cookie_id = secrets.token_hex(4)
+            target = os.path.join(self.folder, f'{cookie_id}.txt')
+            try:
+                os.replace(path, target)
+            except OSError as e:
+                logger.warning(f"Could not move {path} into cookie pool: {e}")
+                return None
+            self.members[cookie_id] = target
+            self.metadata[cookie_id] = metadata or {'upload_time': datetime.now().isoformat(),
+                                                    'filename': os.path.basename(path)}
+            legacy_health = dict(health or {})
+            self.windows[cookie_id] = deque((bool(r) for r in legacy_health.pop('recent_results', [])), maxlen=self.window_size)
+            self.health[cookie_id] = {**self._new_health(), **legacy_health}
+            self._save_metadata()
+            self.dirty = True
+        self.flush()
+        return cookie_id
+
+    def remove(self, cookie_id: str) -> bool:
+        with self.lock:
+            path = self.members.pop(cookie_id, None)
+            self.health.pop(cookie_id, None)
+            self.windows.pop(cookie_id, None)
+            self.metadata.pop(cookie_id, None)
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._save_metadata()
+            self.dirty = True
+        self.flush()
+        return path is not None
+
+    def clear(self) -> List[str]:
+        """Remove every member; returns the removed cookie file paths"""
+        removed = []
+        for cookie_id in self.ids():
+            path = self.path(cookie_id)
+            if self.remove(cookie_id):
+                removed.append(path)
+        return removed
+
+    def ids(self) -> List[str]:
+        with self.lock:
+            return list(self.members)
+
+    def path(self, cookie_id: str) -> Optional[str]:
+        with self.lock:
+            return self.members.get(cookie_id)
+
+    def has_cookies(self) -> bool:
+        with self.lock:
+            return bool(self.members)
+
+    def _quarantined(self, health: Dict, now: float) -> bool:
+        until = health.get('quarantined_until')
+        return bool(until) and until > now
+
+    def select(self) -> Tuple[Optional[str], Optional[str]]:
+        """Pick a cookie for a job, weighted by success rate; (None, None) if none are usable"""
+        now = time.time()
+        with self.lock:
+            candidates = []
+            weights = []
+            for cookie_id, path in self.members.items():
+                health = self.health.get(cookie_id) or self._new_health()
+                if self._quarantined(health, now):
+                    continue
+                # Laplace-smoothed recent success rate: new cookies get traffic and none drops to zero weight
+                window = self.windows.get(cookie_id) or ()
+                weights.append((sum(window) + 1) / (len(window) + 2))
+                candidates.append((cookie_id, path))
+            if not candidates:
+                return None, None
+            return random.choices(candidates, weights=weights)[0]
+
+    def record(self, cookie_id: str, success: bool = True, error_msg: Optional[str] = None) -> Optional[Dict]:
+        """Record a download/probe result for one cookie (memory only; flushed by a timer)"""
+        with self.lock:
+            if cookie_id not in self.members:
+                return None
+            health_data = self.health.setdefault(cookie_id, self._new_health())
+            now = time.time()
+
+            health_data['total_uses'] = health_data.get('total_uses', 0) + 1
+            health_data['last_used'] = now
+            self._window(cookie_id).append(success)
+
+            if success:
+                health_data['successful_uses'] = health_data.get('successful_uses', 0) + 1
+                health_data['last_success'] = now
+                health_data['consecutive_failures'] = 0
+                health_data['quarantined_until'] = None
+            else:
+                health_data['failed_uses'] = health_data.get('failed_uses', 0) + 1
+                health_data['last_failure'] = now
+                health_data['consecutive_failures'] = health_data.get('consecutive_failures', 0) + 1
+
+                if error_msg:
+                    recent_errors = health_data.setdefault('recent_errors', [])
+                    recent_errors.append({'timestamp': now, 'error': error_msg[:200]})
+                    del recent_errors[:-10]
+
+                # 'failing' status starts at 3 consecutive failures
+                if health_data['consecutive_failures'] >= 3 and not self._quarantined(health_data, now):
+                    health_data['quarantined_until'] = now + self.quarantine_seconds
+                    logger.warning(f"Cookie {cookie_id} quarantined for {self.quarantine_seconds // 60} min "
+                                   f"after {health_data['consecutive_failures']} consecutive failures")
+
+            self._mark_dirty()
+            return self._view(cookie_id, health_data)
+
+    def record_probe(self, cookie_id: str, verdict: Dict):
+        with self.lock:
+            if cookie_id not in self.members:
+                return
+            self.health.setdefault(cookie_id, self._new_health())['last_probe'] = verdict
+            self._mark_dirty()
+
+    def get_health(self, cookie_id: str) -> Optional[Dict]:
+        with self.lock:
+            health = self.health.get(cookie_id)
+            return self._view(cookie_id, health) if health else None
+
+    def summary(self) -> List[Dict]:
+        """One entry per cookie for the /cookies page"""
+        now = time.time()
+        with self.lock:
+            entries = []
+            for cookie_id in self.members:
+                health = self._view(cookie_id, self.health.get(cookie_id) or self._new_health())
+                entries.append({
+                    'id': cookie_id,
+                    'metadata': dict(self.metadata.get(cookie_id, {})),
+                    'health': health,
+                    'quarantined': self._quarantined(health, now),
+                    'quarantine_minutes_left': int(max(0, (health.get('quarantined_until') or 0) - now) / 60)
+                })
+            return entries
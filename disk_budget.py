@@ -0,0 +1,117 @@
+import os
+import time
+import shutil
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class DiskBudget:
+    """Storage accountant for /tmp (2GB on Render).
+
+    Each job reserves its expected footprint before it writes anything. Space that is reserved but
+    not yet written is subtracted from the real free space, so concurrent jobs can't all pass a
+    point-in-time check and then exhaust the disk together.
+    """
+
+    def __init__(self):
+        self.path = os.environ.get('DISK_BUDGET_PATH', '/tmp')
+        self.floor_bytes = int(os.environ.get('DISK_SPACE_THRESHOLD_MB', 150)) * 1024 * 1024
+        self.poll_interval = 5
+        # job_id -> {'reserved': bytes promised, 'used': bytes already on disk for that job}
+        self.reservations: Dict[str, Dict[str, int]] = {}
+        self.cond = threading.Condition()
+
+    def _free_bytes(self) -> int:
+        try:
+            return shutil.disk_usage(self.path).free
+        except Exception as e:
+            logger.error(f"Error checking disk space for budget: {e}")
+            return 0
+
+    def _outstanding(self, exclude: Optional[str] = None) -> int:
+        """Reserved bytes not yet written to disk (written bytes already show up in free space)"""
+        return sum(max(0, r['reserved'] - r['used'])
+                   for job_id, r in self.reservations.items() if job_id != exclude)
+
+    def _fits(self, job_id: str, total_bytes: int) -> bool:
+        current = self.reservations.get(job_id, {'reserved': 0, 'used': 0})
+        needed = max(0, total_bytes - max(current['reserved'], current['used']))
+        return needed <= self._free_bytes() - self._outstanding() - self.floor_bytes
+
+    def try_reserve(self, job_id: str, total_bytes: int) -> bool:
+        """Grow job_id's reservation to total_bytes if it fits right now (never shrinks, never waits)"""
+        with self.cond:
+            if not self._fits(job_id, total_bytes):
+                return False
+            entry = self.reservations.setdefault(job_id, {'reserved': 0, 'used': 0})
+            entry['reserved'] = max(entry['reserved'], total_bytes)
+            return True
+
+    def _capacity_bytes(self) -> int:
+        try:
+            return shutil.disk_usage(self.path).total
+        except Exception:
+            return 0
+
+    def reserve(self, job_id: str, total_bytes: int, timeout: float,
+                on_wait: Optional[Callable[[int], None]] = None) -> bool:
+        """Reserve total_bytes for job_id, waiting up to timeout for space to be freed.
+
+        Space comes back when other jobs release their reservations or when expiry/cleanup deletes
+        files, so this waits even when no other reservation is outstanding. Returns False straight
+        away only when total_bytes can't fit even on an empty disk.
+        """
+        deadline = time.monotonic() + timeout
+        notified = not on_wait
+        while True:
+            with self.cond:
+                if self._fits(job_id, total_bytes):
+                    entry = self.reservations.setdefault(job_id, {'reserved': 0, 'used': 0})
+                    entry['reserved'] = max(entry['reserved'], total_bytes)
+                    return True
+
+                remaining = deadline - time.monotonic()
+                capacity = self._capacity_bytes()
+                if remaining <= 0 or (capacity and total_bytes > capacity - self.floor_bytes):
+                    return False
+                outstanding = self._outstanding(exclude=job_id)
+
+                if notified:
+                    # Poll as well as wait: space can also come back from cleanup outside the budget
+                    self.cond.wait(min(remaining, self.poll_interval))
+                    continue
+                notified = True
+            # Called without the budget lock held - on_wait typically takes the status store lock
+            on_wait(outstanding)
+
+    def record_usage(self, job_id: str, used_bytes: int):
+        """Record bytes the job has actually written so far"""
+        with self.cond:
+            entry = self.reservations.get(job_id)
+            if entry is not None:
+                entry['used'] = used_bytes
+
+    def release(self, job_id: str):
+        with self.cond:
+            if self.reservations.pop(job_id, None) is not None:
+                self.cond.notify_all()
+
+    def notify_space_freed(self):
+        """Wake waiters after cleanup deleted files"""
+        with self.cond:
+            self.cond.notify_all()
+
+    def get_stats(self) -> Dict:
+        with self.cond:
+            free = self._free_bytes()
+            outstanding = self._outstanding()
+            return {
+                'free_mb': round(free / (1024 * 1024), 1),
+                'reserved_unwritten_mb': round(outstanding / (1024 * 1024), 1),
+                'available_mb': round((free - outstanding - self.floor_bytes) / (1024 * 1024), 1),
+                'reservations': len(self.reservations)
+            }
+
+disk_budget = DiskBudget()
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+class HostCircuitBreaker:
+    """Circuit breaker for YouTube blocking this server's IP as a whole.
+
+    After `threshold` consecutive jobs that failed on YouTube's bot check from the server IP (each
+    job counts once, after all its clients failed) the circuit opens: jobs fail fast instead of
+    walking every strategy. Once the cooldown is over
+    it goes half-open and a single cheap probe decides whether to close it again or reopen with
+    a doubled cooldown (capped at max_cooldown).
+
+    State is written to disk on every transition so a gunicorn worker restart keeps an open circuit.
+    """
+
+    def __init__(self):
+        self.state_file = os.environ.get('YOUTUBE_BREAKER_FILE', '/tmp/youtube_breaker.json')
+        self.enabled = os.environ.get('ENABLE_YOUTUBE_BREAKER', 'true').lower() == 'true'
+        self.threshold = int(os.environ.get('YOUTUBE_BREAKER_THRESHOLD', 3))
+        self.cooldown = int(os.environ.get('YOUTUBE_BREAKER_COOLDOWN', 600))
+        self.max_cooldown = int(os.environ.get('YOUTUBE_BREAKER_MAX_COOLDOWN', 3600))
+        self.lock = threading.Lock()
+        self.opened = threading.Event()  # Set while the circuit is open; the probe loop waits on it
+        self.state = {
+            'circuit': 'closed',  # closed -> open -> half_open -> closed/open
+            'consecutive_blocks': 0,
+            'open_until': 0,
+            'trips': 0,
+            'last_error': None
+        }
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'r') as f:
+                    self.state.update(json.load(f))
+                if self.state['circuit'] != 'closed':
+                    self.opened.set()
+                    logger.warning(f"YouTube circuit is {self.state['circuit']} (restored from disk)")
+        except Exception as e:
+            logger.warning(f"Could not load YouTube breaker state: {e}")
+
+    def _save(self):
+        try:
+            temp_file = self.state_file + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(temp_file, self.state_file)
+        except Exception as e:
+            logger.warning(f"Could not save YouTube breaker state: {e}")
+
+    def _open_unlocked(self, error_msg: str):
+        cooldown = min(self.max_cooldown, self.cooldown * (2 ** self.state['trips']))
+        self.state.update(circuit='open', open_until=time.time() + cooldown,
+                          trips=self.state['trips'] + 1, last_error=(error_msg or '')[:200])
+        self.opened.set()
+        self._save()
+        logger.error(f"YouTube is blocking this server: circuit open for {cooldown}s "
+                      f"(trip {self.state['trips']})")
+
+    def is_open(self) -> bool:
+        """True while jobs should fail fast (open or waiting for the half-open probe)"""
+        if not self.enabled:
+            return False
+        with self.lock:
+            return self.state['circuit'] != 'closed'
+
+    def seconds_until_probe(self) -> float:
+        with self.lock:
+            return max(0.0, self.state['open_until'] - time.time())
+
+    def record_block(self, error_msg: str = ''):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.state['consecutive_blocks'] += 1
+            if self.state['circuit'] == 'closed' and self.state['consecutive_blocks'] >= self.threshold:
+                self._open_unlocked(error_msg)
+
+    def record_success(self):
+        with self.lock:
+            if self.state['consecutive_blocks'] == 0 and self.state['circuit'] == 'closed':
+                return
+            was_open = self.state['circuit'] != 'closed'
+            self.state.update(circuit='closed', consecutive_blocks=0, trips=0, last_error=None)
+            self.opened.clear()
+            if was_open:
+                self._save()
+                logger.info("YouTube circuit closed - downloads resumed")
+
+    def begin_probe(self) -> bool:
+        """Move an open circuit whose cooldown is over to half-open; True if the caller should probe now"""
+        with self.lock:
+            if self.state['circuit'] == 'closed' or self.state['open_until'] > time.time():
+                return False
+            self.state['circuit'] = 'half_open'
+            return True
+
+    def probe_failed(self, error_msg: str = ''):
+        with self.lock:
+            if self.state['circuit'] == 'half_open':
+                self._open_unlocked(error_msg)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return dict(self.state, enabled=self.enabled,
+                        probe_in_seconds=int(max(0, self.state['open_until'] - time.time())))
+
+youtube_breaker = HostCircuitBreaker()
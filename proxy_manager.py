@@ -1,8 +1,12 @@
 import os
 import json
+import atexit
 import time
+import random
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from collections import deque
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Tuple
 
@@ -12,17 +16,39 @@ class ProxyManager:
     def __init__(self):
         self.cache_file = '/tmp/proxy_cache.json'
         self.proxies: List[Dict] = []
-        self.current_index = 0
         self.last_fetch_time = None
         self.fetch_interval = 3600
         self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()  # Held for a whole refresh so only one runs at a time
+        self.refresh_wakeup = threading.Event()
+        self.refresher_thread: Optional[threading.Thread] = None
+        self.refresh_durations = deque(maxlen=10)  # Seconds taken by recent refreshes
+        self.last_refresh_attempt: Optional[datetime] = None
+        self.refresh_count = 0
+        # Debounced persistence: state changes are batched and written by a timer or a change threshold
+        self.save_lock = threading.Lock()  # Serializes writers of the cache file
+        self.save_timer: Optional[threading.Timer] = None
+        self.pending_changes = 0
+        self.save_interval = int(os.environ.get('PROXY_SAVE_INTERVAL', '30'))
+        self.save_threshold = int(os.environ.get('PROXY_SAVE_THRESHOLD', '20'))
         self.enabled = os.environ.get('ENABLE_PROXY_ROTATION', 'false').lower() == 'true'
         self.test_timeout = int(os.environ.get('PROXY_TEST_TIMEOUT', '5'))
         self.max_proxies = int(os.environ.get('MAX_PROXY_CACHE', '20'))
+        self.test_workers = int(os.environ.get('PROXY_TEST_WORKERS', '10'))
+        self.refresh_deadline = int(os.environ.get('PROXY_REFRESH_DEADLINE', '20'))  # Overall cap on a validation round
+        self.refresh_ahead = int(os.environ.get('PROXY_REFRESH_AHEAD', '300'))  # Start refreshing this long before expiry
+        self.refresh_retry = int(os.environ.get('PROXY_REFRESH_RETRY', '120'))  # Back-off after a refresh found nothing
+        # Per-proxy EWMAs and circuit breaker
+        self.ewma_alpha = float(os.environ.get('PROXY_EWMA_ALPHA', '0.3'))
+        self.breaker_threshold = int(os.environ.get('PROXY_BREAKER_THRESHOLD', '3'))  # Consecutive failures that open the circuit
+        self.breaker_cooldown = int(os.environ.get('PROXY_BREAKER_COOLDOWN', '300'))  # First open period; doubles on each re-trip
+        self.breaker_max_trips = int(os.environ.get('PROXY_BREAKER_MAX_TRIPS', '4'))  # Drop the proxy after this many trips
+        self.half_open_window = 60  # A half-open proxy gets one trial; others skip it for this long
         
         if self.enabled:
             logger.info("Proxy rotation enabled")
             self._load_cache()
+            atexit.register(self.flush)
         else:
             logger.info("Proxy rotation disabled (set ENABLE_PROXY_ROTATION=true to enable)")
     
@@ -40,15 +66,40 @@ class ProxyManager:
             logger.warning(f"Could not load proxy cache: {e}")
             self.proxies = []
     
-    def _save_cache(self):
-        try:
-            with open(self.cache_file, 'w') as f:
-                json.dump({
-                    'proxies': self.proxies,
+    def _mark_dirty(self) -> bool:
+        """Note a state change (call with self.lock held); True when the caller should flush now"""
+        self.pending_changes += 1
+        if self.pending_changes >= self.save_threshold:
+            return True
+        if self.save_timer is None:
+            self.save_timer = threading.Timer(self.save_interval, self._timer_flush)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+        return False
+
+    def _timer_flush(self):
+        with self.lock:
+            self.save_timer = None
+        self.flush()
+
+    def flush(self):
+        """Write pending state to the cache file (atomic replace); no-op when nothing changed"""
+        with self.save_lock:
+            with self.lock:
+                if not self.pending_changes:
+                    return
+                self.pending_changes = 0
+                snapshot = {
+                    'proxies': [dict(proxy) for proxy in self.proxies],
                     'last_fetch_time': self.last_fetch_time.isoformat() if self.last_fetch_time else None
-                }, f)
-        except Exception as e:
-            logger.warning(f"Could not save proxy cache: {e}")
+                }
+            try:
+                temp_file = self.cache_file + '.tmp'
+                with open(temp_file, 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(temp_file, self.cache_file)
+            except Exception as e:
+                logger.warning(f"Could not save proxy cache: {e}")
     
     def _fetch_free_proxies(self) -> List[Dict]:
         proxies = []
@@ -119,7 +170,8 @@ class ProxyManager:
             logger.warning(f"GeoNode parsing error: {e}")
         return proxies
     
-    def _test_proxy(self, proxy_url: str) -> bool:
+    def _test_proxy(self, proxy_url: str) -> Optional[float]:
+        """Round-trip time in seconds if the proxy works, else None"""
         try:
             import requests
             test_url = 'https://www.google.com'
@@ -127,98 +179,236 @@ class ProxyManager:
                 'http': proxy_url,
                 'https': proxy_url
             }
+            started = time.monotonic()
             response = requests.get(test_url, proxies=proxies, timeout=self.test_timeout)
-            return response.status_code == 200
+            if response.status_code == 200:
+                return max(time.monotonic() - started, 0.001)
+            return None
         except:
-            return False
+            return None
     
+    def _validate_proxies(self, candidates: List[Dict]) -> List[Dict]:
+        """Test candidates concurrently; stop once max_proxies work or refresh_deadline passes"""
+        working = []
+        deadline = time.monotonic() + self.refresh_deadline
+        executor = ThreadPoolExecutor(max_workers=max(1, self.test_workers))
+        futures = {executor.submit(self._test_proxy, proxy['url']): proxy for proxy in candidates}
+        try:
+            for i, future in enumerate(as_completed(futures, timeout=self.refresh_deadline), 1):
+                proxy = futures[future]
+                latency = future.result()
+                if latency:
+                    proxy['tested'] = True
+                    proxy['success_count'] = 1
+                    proxy['latency_ewma'] = round(latency, 3)
+                    proxy['success_ewma'] = 1.0
+                    working.append(proxy)
+                    logger.info(f"✓ Working proxy found: {proxy['url']}")
+
+                    if len(working) >= self.max_proxies:
+                        break
+
+                if i % 10 == 0:
+                    logger.info(f"Tested {i}/{len(candidates)} proxies, found {len(working)} working")
+
+                if time.monotonic() >= deadline:
+                    break
+        except FuturesTimeout:
+            logger.warning(f"Proxy validation deadline ({self.refresh_deadline}s) reached with {len(working)} working")
+        finally:
+            # Don't wait for stragglers; they finish on their own within test_timeout
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+        return working
+
     def _refresh_proxies(self):
-        with self.lock:
-            now = datetime.now()
-            
-            if self.last_fetch_time:
-                time_since_fetch = (now - self.last_fetch_time).total_seconds()
-                if time_since_fetch < self.fetch_interval and len(self.proxies) > 0:
-                    logger.debug(f"Using cached proxies ({int(time_since_fetch)}s since last fetch)")
-                    return
+        # Network I/O happens without self.lock so get_proxy() keeps serving the current list
+        if not self.refresh_lock.acquire(blocking=False):
+            logger.debug("Proxy refresh already in progress")
+            return
+        try:
+            with self.lock:
+                now = datetime.now()
+                if self.last_fetch_time:
+                    time_since_fetch = (now - self.last_fetch_time).total_seconds()
+                    if time_since_fetch < self.fetch_interval - self.refresh_ahead and len(self.proxies) > 0:
+                        logger.debug(f"Using cached proxies ({int(time_since_fetch)}s since last fetch)")
+                        return
+                self.last_refresh_attempt = now
             
+            started = time.monotonic()
             logger.info("Refreshing proxy list...")
             new_proxies = self._fetch_free_proxies()
             
             if new_proxies:
-                logger.info(f"Testing {len(new_proxies)} proxies (timeout: {self.test_timeout}s)...")
-                tested_proxies = []
-                
-                for i, proxy in enumerate(new_proxies[:30]):
-                    if self._test_proxy(proxy['url']):
-                        proxy['tested'] = True
-                        proxy['success_count'] = 1
-                        tested_proxies.append(proxy)
-                        logger.info(f"✓ Working proxy found: {proxy['url']}")
-                        
-                        if len(tested_proxies) >= self.max_proxies:
-                            break
-                    
-                    if i > 0 and i % 10 == 0:
-                        logger.info(f"Tested {i}/{len(new_proxies[:30])} proxies, found {len(tested_proxies)} working")
+                candidates = new_proxies[:30]
+                logger.info(f"Testing {len(candidates)} proxies concurrently "
+                            f"(timeout: {self.test_timeout}s each, {self.refresh_deadline}s overall)...")
+                tested_proxies = self._validate_proxies(candidates)
                 
                 if tested_proxies:
-                    self.proxies = tested_proxies
-                    self.current_index = 0
-                    self.last_fetch_time = now
-                    self._save_cache()
-                    logger.info(f"✓ Proxy refresh complete: {len(self.proxies)} working proxies available")
+                    with self.lock:
+                        self.proxies = tested_proxies
+                        self.last_fetch_time = now
+                        self.pending_changes += 1
+                    self.flush()  # A new list is worth persisting straight away
+                    logger.info(f"✓ Proxy refresh complete: {len(tested_proxies)} working proxies available")
                 else:
                     logger.warning("No working proxies found during refresh")
             else:
                 logger.warning("Failed to fetch any proxies from APIs")
+
+            with self.lock:
+                self.refresh_durations.append(round(time.monotonic() - started, 1))
+                self.refresh_count += 1
+        finally:
+            self.refresh_lock.release()
     
-    def get_proxy(self) -> Optional[str]:
+    def _seconds_until_refresh(self) -> float:
+        with self.lock:
+            if not self.proxies or not self.last_fetch_time:
+                return 0
+            age = (datetime.now() - self.last_fetch_time).total_seconds()
+            return self.fetch_interval - self.refresh_ahead - age
+
+    def _refresher_loop(self):
+        """Refresh ahead of expiry so get_proxy() never waits on the network"""
+        while True:
+            wait = self._seconds_until_refresh()
+            if wait > 0:
+                self.refresh_wakeup.wait(wait)
+                self.refresh_wakeup.clear()
+                continue
+
+            previous_fetch = self.last_fetch_time
+            self.refresh_wakeup.clear()  # Wakeups from before this round are answered by it
+            self._refresh_proxies()
+            if self.last_fetch_time == previous_fetch:
+                # Nothing new (APIs down or no working proxies) - keep serving the old list and retry later
+                self.refresh_wakeup.wait(self.refresh_retry)
+                self.refresh_wakeup.clear()
+
+    def _ensure_refresher(self):
+        with self.lock:
+            if self.refresher_thread is None or not self.refresher_thread.is_alive():
+                self.refresher_thread = threading.Thread(target=self._refresher_loop, daemon=True)
+                self.refresher_thread.start()
+
+    def get_proxy(self, exclude: Optional[set] = None) -> Optional[str]:
+        """Pick a proxy URL, skipping any in exclude (e.g. ones that already failed for this job)"""
         if not self.enabled:
             return None
         
-        if not self.proxies or (self.last_fetch_time and 
-            (datetime.now() - self.last_fetch_time).total_seconds() > self.fetch_interval):
-            self._refresh_proxies()
-        
-        if not self.proxies:
-            logger.warning("No proxies available")
-            return None
+        # Stale-while-revalidate: serve whatever list we have, the background thread replaces it
+        self._ensure_refresher()
         
         with self.lock:
-            proxy = self.proxies[self.current_index]
-            self.current_index = (self.current_index + 1) % len(self.proxies)
-            logger.info(f"Using proxy {self.current_index}/{len(self.proxies)}: {proxy['url']}")
+            if not self.proxies:
+                logger.warning("No proxies available")
+                # Wake the refresher early, but not during its retry back-off (the APIs may be down)
+                last_attempt = self.last_refresh_attempt
+                if last_attempt is None or (datetime.now() - last_attempt).total_seconds() >= self.refresh_retry:
+                    self.refresh_wakeup.set()
+                return None
+            now = time.time()
+            # Closed circuits, plus open ones whose cooldown is over (they get a half-open trial)
+            available = [p for p in self.proxies
+                         if (p.get('circuit', 'closed') == 'closed' or now >= p.get('open_until', 0))
+                         and not (exclude and p['url'] in exclude)]
+            if not available:
+                logger.warning("All proxy circuits are open")
+                return None
+
+            # A proxy whose cooldown is over gets its single half-open trial first, otherwise
+            # power of two choices: sample two, keep the better score
+            trial = next((p for p in available if p.get('circuit', 'closed') != 'closed'), None)
+            if trial:
+                proxy = trial
+            elif len(available) == 1:
+                proxy = available[0]
+            else:
+                first, second = random.sample(available, 2)
+                proxy = first if self._score(first) >= self._score(second) else second
+
+            if proxy.get('circuit', 'closed') != 'closed':
+                proxy['circuit'] = 'half_open'
+                proxy['open_until'] = now + self.half_open_window
+                logger.info(f"Trying half-open proxy {proxy['url']}")
+            logger.info(f"Using proxy {proxy['url']} (score {self._score(proxy):.2f})")
             return proxy['url']
     
-    def mark_proxy_success(self, proxy_url: str):
+    def _score(self, proxy: Dict) -> float:
+        """Expected successes per second of cost: EWMA success rate over latency plus transfer time"""
+        success = proxy.get('success_ewma', 0.5)
+        latency = proxy.get('latency_ewma', self.test_timeout)
+        throughput = proxy.get('throughput_ewma')
+        # Time to move 1MB; assume a slow link until a download has measured it
+        transfer = (1024 * 1024) / throughput if throughput else 10.0
+        return success / (latency + transfer)
+
+    def _ewma(self, previous: Optional[float], sample: float) -> float:
+        if previous is None:
+            return sample
+        return self.ewma_alpha * sample + (1 - self.ewma_alpha) * previous
+
+    def _find(self, proxy_url: str) -> Optional[Dict]:
+        for proxy in self.proxies:
+            if proxy['url'] == proxy_url:
+                return proxy
+        return None
+
+    def mark_proxy_success(self, proxy_url: str, latency: Optional[float] = None,
+                           throughput: Optional[float] = None):
+        """Record a successful request; latency in seconds, throughput in bytes/second"""
         if not self.enabled or not proxy_url:
             return
         
         with self.lock:
-            for proxy in self.proxies:
-                if proxy['url'] == proxy_url:
-                    proxy['success_count'] = proxy.get('success_count', 0) + 1
-                    proxy['fail_count'] = max(0, proxy.get('fail_count', 0) - 1)
-                    break
-            self._save_cache()
+            proxy = self._find(proxy_url)
+            if proxy:
+                proxy['success_count'] = proxy.get('success_count', 0) + 1
+                proxy['fail_count'] = max(0, proxy.get('fail_count', 0) - 1)
+                proxy['success_ewma'] = round(self._ewma(proxy.get('success_ewma'), 1.0), 3)
+                if latency:
+                    proxy['latency_ewma'] = round(self._ewma(proxy.get('latency_ewma'), latency), 3)
+                if throughput:
+                    proxy['throughput_ewma'] = round(self._ewma(proxy.get('throughput_ewma'), throughput))
+                proxy['consecutive_failures'] = 0
+                if proxy.get('circuit', 'closed') != 'closed':
+                    logger.info(f"Proxy circuit closed: {proxy_url}")
+                proxy['circuit'] = 'closed'
+                proxy['trips'] = 0
+                proxy.pop('open_until', None)
+            flush_now = self._mark_dirty()
+        if flush_now:
+            self.flush()
     
     def mark_proxy_failed(self, proxy_url: str):
         if not self.enabled or not proxy_url:
             return
         
         with self.lock:
-            for i, proxy in enumerate(self.proxies):
-                if proxy['url'] == proxy_url:
-                    proxy['fail_count'] = proxy.get('fail_count', 0) + 1
-                    
-                    if proxy['fail_count'] >= 3:
-                        logger.warning(f"Removing failed proxy: {proxy_url}")
-                        self.proxies.pop(i)
-                        if self.current_index >= len(self.proxies):
-                            self.current_index = 0
-                    break
-            self._save_cache()
+            proxy = self._find(proxy_url)
+            if proxy:
+                proxy['fail_count'] = proxy.get('fail_count', 0) + 1
+                proxy['success_ewma'] = round(self._ewma(proxy.get('success_ewma'), 0.0), 3)
+                proxy['consecutive_failures'] = proxy.get('consecutive_failures', 0) + 1
+
+                # A failed half-open trial re-trips immediately; a closed circuit trips at the threshold
+                if proxy.get('circuit') == 'half_open' or proxy['consecutive_failures'] >= self.breaker_threshold:
+                    proxy['trips'] = proxy.get('trips', 0) + 1
+                    if proxy['trips'] >= self.breaker_max_trips:
+                        logger.warning(f"Removing proxy after {proxy['trips']} circuit trips: {proxy_url}")
+                        self.proxies.remove(proxy)
+                    else:
+                        cooldown = min(self.breaker_cooldown * 2 ** (proxy['trips'] - 1), self.fetch_interval)
+                        proxy['circuit'] = 'open'
+                        proxy['open_until'] = time.time() + cooldown
+                        logger.warning(f"Proxy circuit open for {cooldown}s: {proxy_url}")
+            flush_now = self._mark_dirty()
+        if flush_now:
+            self.flush()
     
     def get_next_proxy_with_fallback(self) -> Tuple[Optional[str], bool]:
         proxy = self.get_proxy()
@@ -231,9 +421,15 @@ class ProxyManager:
             return {
                 'enabled': self.enabled,
                 'total_proxies': len(self.proxies),
-                'current_index': self.current_index,
+                'open_circuits': sum(1 for p in self.proxies if p.get('circuit', 'closed') != 'closed'),
                 'last_fetch': self.last_fetch_time.isoformat() if self.last_fetch_time else None,
-                'cache_age_seconds': int((datetime.now() - self.last_fetch_time).total_seconds()) if self.last_fetch_time else None
+                'cache_age_seconds': int((datetime.now() - self.last_fetch_time).total_seconds()) if self.last_fetch_time else None,
+                'stale': bool(self.last_fetch_time) and (datetime.now() - self.last_fetch_time).total_seconds() > self.fetch_interval,
+                'refreshing': self.refresh_lock.locked(),
+                'refresh_count': self.refresh_count,
+                'last_refresh_attempt': self.last_refresh_attempt.isoformat() if self.last_refresh_attempt else None,
+                'last_refresh_seconds': self.refresh_durations[-1] if self.refresh_durations else None,
+                'avg_refresh_seconds': round(sum(self.refresh_durations) / len(self.refresh_durations), 1) if self.refresh_durations else None
             }
 
 proxy_manager = ProxyManager()
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+class RateGovernor:
+    """Token bucket for outbound YouTube requests with an adaptive (AIMD) refill rate.
+
+    Every request takes a token; the bucket refills at `rate` tokens per second up to `burst`.
+    A 403/429 halves the rate and empties the bucket, so the next requests back off together;
+    each clean response adds a small step back, so a healthy YouTube is not paced by old penalties.
+
+    With RATE_GOVERNOR_STATE_FILE set, the bucket lives in that file under an flock, so several
+    processes on one host (e.g. an old and a new gunicorn worker) share one budget.
+    """
+
+    def __init__(self):
+        self.min_rate = float(os.environ.get('RATE_GOVERNOR_MIN_RATE', 0.1))  # Requests/second floor after repeated blocks
+        self.max_rate = float(os.environ.get('RATE_GOVERNOR_MAX_RATE', 5))
+        self.initial_rate = float(os.environ.get('RATE_GOVERNOR_INITIAL_RATE', 2))
+        self.burst = float(os.environ.get('RATE_GOVERNOR_BURST', 5))
+        self.increase_step = float(os.environ.get('RATE_GOVERNOR_STEP', 0.05))  # Added per clean response
+        self.decrease_factor = float(os.environ.get('RATE_GOVERNOR_BACKOFF', 0.5))  # Applied per 403/429
+        self.decrease_gap = float(os.environ.get('RATE_GOVERNOR_BACKOFF_GAP', 5))  # One backoff per burst of errors
+        self.state_file = os.environ.get('RATE_GOVERNOR_STATE_FILE', '')
+        self.lock = threading.Lock()
+        self.state = self._new_state()
+        self.waited_seconds = 0.0
+        self.throttles = 0
+
+    def _new_state(self) -> Dict:
+        return {'rate': self.initial_rate, 'tokens': self.burst, 'updated': time.time(), 'last_backoff': 0}
+
+    def _update(self, change: Callable[[Dict], float]) -> float:
+        """Apply change(state) to the (possibly shared) bucket and return its result"""
+        with self.lock:
+            if not self.state_file:
+                return change(self.state)
+            try:
+                import fcntl
+                with open(self.state_file, 'a+') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    f.seek(0)
+                    try:
+                        self.state = {**self._new_state(), **json.loads(f.read() or '{}')}
+                    except ValueError:
+                        self.state = self._new_state()
+                    result = change(self.state)
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(self.state, f)
+                    return result
+            except (ImportError, OSError) as e:
+                logger.warning(f"Shared rate governor state unavailable, using this process only: {e}")
+                self.state_file = ''
+                return change(self.state)
+
+    def _refill(self, state: Dict, now: float):
+        elapsed = max(0.0, now - state['updated'])
+        state['tokens'] = min(self.burst, state['tokens'] + elapsed * state['rate'])
+        state['updated'] = now
+
+    def acquire(self) -> float:
+        """Block until a request may go out; returns the seconds waited"""
+        def take(state):
+            self._refill(state, time.time())
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+                return 0.0
+            return (1 - state['tokens']) / state['rate']
+
+        waited = 0.0
+        while True:
+            wait = self._update(take)
+            if wait <= 0:
+                if waited:
+                    with self.lock:
+                        self.waited_seconds += waited
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def on_success(self):
+        def speed_up(state):
+            state['rate'] = min(self.max_rate, state['rate'] + self.increase_step)
+            return state['rate']
+        self._update(speed_up)
+
+    def on_throttle(self):
+        """YouTube pushed back (403/429/bot check): halve the rate and drain the bucket"""
+        def back_off(state):
+            now = time.time()
+            if now - state['last_backoff'] < self.decrease_gap:
+                return 0
+            self._refill(state, now)
+            state['rate'] = max(self.min_rate, state['rate'] * self.decrease_factor)
+            state['tokens'] = min(state['tokens'], 0)
+            state['last_backoff'] = now
+            return state['rate']
+
+        rate = self._update(back_off)
+        if rate:
+            with self.lock:
+                self.throttles += 1
+            logger.warning(f"YouTube is throttling, outbound rate lowered to {rate:.2f} req/s")
+
+    def get_stats(self) -> Dict:
+        self._update(lambda state: self._refill(state, time.time()))  # Current tokens (and shared state)
+        with self.lock:
+            return {
+                'rate_per_second': round(self.state['rate'], 2),
+                'tokens': round(self.state['tokens'], 2),
+                'throttles': self.throttles,
+                'waited_seconds': round(self.waited_seconds, 1),
+                'shared': bool(self.state_file)
+            }
+
+youtube_governor = RateGovernor()
@@ -0,0 +1,117 @@
+import os
+import json
+import random
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class StrategyStats:
+    """Sliding-window outcome stats per download strategy, used to order strategies per job.
+
+    Ordering is Thompson sampling: each strategy draws a success probability from
+    Beta(successes + prior, failures + prior) over its recent window, discounted by its mean latency.
+    Latency is extraction time (up to the first media byte), never the download itself, so clients
+    aren't ranked by the length of the videos they happened to get.
+    Strategies that are currently working float to the front, while the sampling noise still sends
+    some traffic to the others so a recovered client gets noticed. The configured order acts as a
+    prior worth a few attempts, so with no data the original order is the most likely one.
+    """
+
+    def __init__(self):
+        self.stats_file = os.environ.get('STRATEGY_STATS_FILE', '/tmp/strategy_stats.json')
+        self.window_size = int(os.environ.get('STRATEGY_STATS_WINDOW', 50))
+        self.flush_interval = int(os.environ.get('STRATEGY_STATS_FLUSH_INTERVAL', 60))
+        self.enabled = os.environ.get('ADAPTIVE_STRATEGY_ORDER', 'true').lower() == 'true'
+        self.lock = threading.Lock()
+        self.windows: Dict[str, deque] = {}  # strategy name -> recent (success, extraction seconds) pairs
+        self.dirty = False
+        self.flush_timer: Optional[threading.Timer] = None
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.stats_file):
+                with open(self.stats_file, 'r') as f:
+                    data = json.load(f)
+                for name, outcomes in data.items():
+                    self.windows[name] = deque(((bool(ok), float(seconds)) for ok, seconds in outcomes),
+                                               maxlen=self.window_size)
+        except Exception as e:
+            logger.warning(f"Could not load strategy stats: {e}")
+
+    def _window(self, name: str) -> deque:
+        window = self.windows.get(name)
+        if window is None:
+            window = self.windows[name] = deque(maxlen=self.window_size)
+        return window
+
+    def record(self, name: str, success: bool, seconds: float):
+        """Record one attempt (memory only; flushed by a timer)"""
+        with self.lock:
+            self._window(name).append((success, round(seconds, 1)))
+            self.dirty = True
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_interval, self._timer_flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def _timer_flush(self):
+        with self.lock:
+            self.flush_timer = None
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            snapshot = {name: [[int(ok), seconds] for ok, seconds in window]
+                        for name, window in self.windows.items()}
+        try:
+            temp_file = self.stats_file + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(temp_file, self.stats_file)
+        except Exception as e:
+            logger.warning(f"Could not save strategy stats: {e}")
+
+    def order(self, strategies: List[Dict]) -> List[Dict]:
+        """Return strategies (dicts with a 'name') in the order this job should try them"""
+        if not self.enabled or len(strategies) < 2:
+            return list(strategies)
+
+        count = len(strategies)
+        scored = []
+        with self.lock:
+            for position, strategy in enumerate(strategies):
+                window = self.windows.get(strategy['name']) or ()
+                successes = sum(1 for ok, _ in window if ok)
+                failures = len(window) - successes
+                # Prior from the configured order (worth a few attempts): earlier strategies start ahead
+                prior_success = 1 + 3 * (count - position) / count
+                prior_failure = 1 + 3 * position / count
+                sample = random.betavariate(successes + prior_success, failures + prior_failure)
+                # Discount slow strategies (two minutes per attempt halves the score)
+                mean_seconds = sum(seconds for _, seconds in window) / len(window) if window else 0
+                scored.append((sample / (1 + mean_seconds / 120), -position, strategy))
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [strategy for _, _, strategy in scored]
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = {}
+            for name, window in self.windows.items():
+                if not window:
+                    continue
+                successes = sum(1 for ok, _ in window if ok)
+                stats[name] = {
+                    'attempts': len(window),
+                    'success_rate': round(successes / len(window) * 100, 1),
+                    'avg_seconds': round(sum(seconds for _, seconds in window) / len(window), 1)
+                }
+            return {'adaptive': self.enabled, 'strategies': stats}
+
+strategy_stats = StrategyStats()
@@ -0,0 +1,100 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+class TTLCache:
+    """Bounded LRU cache with per-entry TTL and request coalescing.
+
+    get_or_load() runs the loader once per key even when many threads ask at the same time:
+    the first caller loads, the others wait for its result (or its exception). Errors are
+    never cached.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self.inflight: Dict[Hashable, _InFlight] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # get_or_load() outcomes, reported by get_stats() in /health?details=1
+
+    def _get_unlocked(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return default
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            return self._get_unlocked(key, default)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any],
+                    usable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Cached value for key, else loader()'s. A cached value that usable() rejects is reloaded."""
+        missing = object()
+        while True:
+            with self.lock:
+                value = self._get_unlocked(key, missing)
+                if value is not missing and (usable is None or usable(value)):
+                    self.hits += 1
+                    return value
+                flight = self.inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.inflight[key] = _InFlight()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+
+            if not leader:
+                flight.done.wait()
+                if flight.error is not None:
+                    raise flight.error
+                if usable is None or usable(flight.value):
+                    return flight.value
+                continue  # The load we joined doesn't cover this caller - load again as leader
+
+            try:
+                flight.value = loader()
+                self.set(key, flight.value)
+                return flight.value
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                with self.lock:
+                    self.inflight.pop(key, None)
+                flight.done.set()
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced
+            }